@@ -1,17 +1,22 @@
+import collections
 import datetime
+import queue
 import re
-import select
 import socket
 import threading
 import time
+import types
 
 from pytwitchirc.event import Event, CurrentEvent
+from pytwitchirc.scheduler import ChannelScheduler
+from pytwitchirc.transport import TCPTransport, TLSTransport
 
 
 class IRC:
 
     def __init__(self, nickname: str, oauth: str, host='irc.chat.twitch.tv', port=6667,
-                 log_settings=(0, 0, 0, 0), throttle=20, log_file=None, how_many=5, max_try=5):
+                 log_settings=(0, 0, 0, 0), throttle=20, log_file=None, how_many=5, max_try=5,
+                 join_throttle=20, transport=None):
         """
 
         :param nickname: lowercase twitch username of the bot
@@ -23,6 +28,8 @@ class IRC:
         :param log_file: path to the desired log file
         :param how_many: maximum new connection per run loop
         :param max_try: maximum try before abort joining a channel
+        :param join_throttle: maximum number of channel joined per 10s
+        :param transport: Transport used to reach the server, TLS if port is 6697 and plain TCP otherwise if None
         """
 
         self.__nickname = nickname.lower()
@@ -35,22 +42,32 @@ class IRC:
         self.__how_many = how_many
         self.__max_try = max_try
 
-        self.__socket = None
+        if transport is None:
+            transport = TLSTransport() if port == 6697 else TCPTransport()
+        self.__transport = transport
         self.__buffer = b''
         self.__last_ping = time.time()
 
         self.__event = CurrentEvent()
         self.__event_sent_date = []
-        self.__event_buffer = []
-        self.__received_event = []
+        self.__event_buffer = collections.deque()
+        self.__received_event = collections.deque()
         self.__status = -1
 
-        self.channels = {}
+        # requests from the caller threads, applied by the IO thread
+        self.__commands = queue.SimpleQueue()
+
+        # channel state, only touched by the IO thread and published as a read-only snapshot
+        self.__channels = {}
+        self.__channels_dirty = set()
+        self.__channels_snapshot = types.MappingProxyType({})
         self.__channels_to_part = []
         self.__channels_to_join = []
-        self.__to_join = []
-        self.__to_part = []
-        self.__to_send = []
+        self.__to_join = ChannelScheduler('JOIN', max_try=max_try, throttle=join_throttle)
+        self.__to_part = ChannelScheduler('PART', max_try=max_try)
+        self.__to_send = collections.deque()
+        # messages waiting for their channel to be joined, channel -> list of messages
+        self.__held_messages = {}
 
         self.__capabilities_acknowledged = {
             "twitch.tv/tags": False,
@@ -90,6 +107,11 @@ class IRC:
                 'method': self.__on_part_handler,
                 'args': [self.__event]
             },
+            {
+                'type': 'NOTICE',
+                'method': self.__on_notice_handler,
+                'args': [self.__event]
+            },
             {
                 'type': '353',
                 'method': self.__on_353_handler,
@@ -103,18 +125,19 @@ class IRC:
         ]
 
         # Starting a parallel thread to keep the IRC client running
-        __thread = threading.Thread(target=self.__run, args=())
-        __thread.daemon = True
-        __thread.start()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, args=())
+        self.__thread.daemon = True
+        self.__thread.start()
 
         time.sleep(1)
 
     def __run(self):
-        while True:
+        while self.__running:
             try:
                 self.__init_connection()
 
-                while True:
+                while self.__running:
                     # check connection status
                     if self.__is_timed_out():
                         self.__warning('Client didn\'t receive ping for too long')
@@ -136,11 +159,13 @@ class IRC:
             except OSError as e:
                 self.__reset_connection("OSError raised : {} . Trying to reconnect.".format(e.strerror))
                 print(e.args)
+        self.__transport.close()
 
     def __process_socket(self):
         self.__receive_data()
+        self.__process_commands()
         while len(self.__event_buffer) > 0:
-            tmp = self.__event_buffer.pop(0)
+            tmp = self.__event_buffer.popleft()
 
             try:
                 event = self.__parse(tmp)
@@ -158,47 +183,44 @@ class IRC:
 
         if self.__status == 3:
             # connect scheduled channels
-            if len(self.__to_join) > 0:
-                # retrieve the first channel to join
-                item = self.__to_join.pop(0)
-                channel = item[0]
-                counter = item[1]
-                timestamp = item[2]
-                # if the last try is below 5s old or the socket is throttling
-                if time.time() - timestamp < 5 or not self.__socket_locked():
-                    self.__to_join.append((channel, counter, timestamp))
-                # else if the counter is below max_try
-                elif counter < self.__max_try:
-                    # send the join request
-                    self.__request_join(channel)
-                    # add back to the list
-                    counter += 1
-                    self.__to_join.append((channel, counter, time.time()))
+            self.__request_channels(self.__to_join, 'join')
             # send scheduled messages
             self.__send_message()
-            # connect scheduled channels
-            if len(self.__to_part) > 0:
-                # retrieve the first channel to part
-                item = self.__to_part.pop(0)
-                channel = item[0]
-                counter = item[1]
-                timestamp = item[2]
-                # if the last try is below 5s old or the socket is throttling
-                if time.time() - timestamp < 5 or not self.__socket_locked():
-                    self.__to_part.append((channel, counter, timestamp))
-                # else if the counter is below max_try
-                elif counter < self.__max_try:
-                    # send the part request
-                    self.__request_part(channel)
-                    # add back to the list
-                    counter += 1
-                    self.__to_part.append((channel, counter, time.time()))
-                else:
-                    self.__warning('Failed to join channel {}'.format(channel))
+            # disconnect scheduled channels
+            self.__request_channels(self.__to_part, 'part')
+
+        self.__publish_channels()
+
+    # apply the requests queued by the caller threads
+    def __process_commands(self):
+        while True:
+            try:
+                command, args = self.__commands.get_nowait()
+            except queue.Empty:
+                return
+            command(*args)
+
+    # queue a request for the IO thread and wake it up
+    def __request(self, command, *args):
+        self.__commands.put((command, args))
+        self.__transport.wakeup()
+
+    # replace the snapshot of the channels modified since the last publication
+    def __publish_channels(self):
+        if not self.__channels_dirty:
+            return
+        snapshot = dict(self.__channels_snapshot)
+        for channel in self.__channels_dirty:
+            if channel in self.__channels:
+                snapshot[channel] = tuple(self.__channels[channel])
+            else:
+                snapshot.pop(channel, None)
+        self.__channels_dirty.clear()
+        self.__channels_snapshot = types.MappingProxyType(snapshot)
 
     def __init_connection(self):
         self.__connect()
-        self.list_all_channels_to_reconnect()
+        self.__list_all_channels_to_reconnect()
 
     def __reset_connection(self, warn=None):
         # print the warning if needed
@@ -207,15 +229,18 @@ class IRC:
         # emptying the buffer
         self.__buffer = b''
         # emptying the channel list
-        channels = list(self.channels)
-        self.channels.clear()
+        channels = list(self.__channels)
+        self.__channels.clear()
+        self.__channels_dirty.update(channels)
+        self.__publish_channels()
         for channel in channels:
-            self.join(channel)
-        print(len(self.channels))
+            # channels waiting for a disconnection are not joined back
+            if channel not in self.__to_part:
+                self.__join(channel)
         # reset status variables
         self.__last_ping = time.time()
 
-        self.__socket = None
+        self.__transport.close()
         for key in self.__capabilities_acknowledged:
             self.__capabilities_acknowledged[key] = False
         self.__set_status(-1)
@@ -254,10 +279,24 @@ class IRC:
 
     # get all received event and clear event buffer
     def get_event(self) -> list:
-        events = self.__received_event
-        self.__received_event = []
+        events = []
+        for _ in range(len(self.__received_event)):
+            events.append(self.__received_event.popleft())
         return events
 
+    # stop the client thread and release the transport, the client can't be used anymore
+    def close(self) -> None:
+        self.__running = False
+        self.__transport.wakeup()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__transport.dispose()
+
+    # read-only snapshot of the connected channels and their chatters
+    @property
+    def channels(self):
+        return self.__channels_snapshot
+
     """
     Handlers
     """
@@ -281,28 +320,30 @@ class IRC:
     # fetch chatter names
     def __on_353_handler(self, event) -> None:
         for chatter in event.content.split(' '):
-            self.channels[event.channel].append(chatter)
+            self.__channels[event.channel].append(chatter)
+        self.__channels_dirty.add(event.channel)
 
     # notify a successful connection or a chatter joining
     def __on_join_handler(self, event) -> None:
         # if the author is the client
         if event.author == self.__nickname:
             self.__notice('Successfully connected to {}'.format(event.channel))
-            self.channels[event.channel] = []
-            for i in range(0, len(self.__to_join)):
-                if self.__to_join[i][0] == event.channel:
-                    self.__to_join.pop(i)
-                    break
+            self.__channels[event.channel] = []
+            self.__to_join.confirm(event.channel)
+            self.__release_messages(event.channel)
         # if the author is a chatter
         else:
-            self.channels[event.channel].append(event.author)
+            self.__channels[event.channel].append(event.author)
+        self.__channels_dirty.add(event.channel)
 
     # notify a channel disconnection or a chatter leaving
     def __on_part_handler(self, event) -> None:
         # if trigger by the client
         if event.author == self.__nickname:
+            self.__to_part.confirm(event.channel)
             try:
-                self.channels.pop(event.channel)
+                self.__channels.pop(event.channel)
+                self.__channels_dirty.add(event.channel)
                 self.__notice('Successfully disconnected from {}'.format(event.channel))
             except KeyError:
                 self.__notice('Channel {author} disconnected, '
@@ -310,11 +351,19 @@ class IRC:
         # if trigger by other chatter
         else:
             try:
-                self.channels[event.channel].remove(event.author)
+                self.__channels[event.channel].remove(event.author)
+                self.__channels_dirty.add(event.channel)
             except ValueError:
                 self.__notice('User {author} disconnected from {channel}, '
                               'but wasn\'t connected'.format(**event.__dict__))
 
+    # abort joining a suspended channel
+    def __on_notice_handler(self, event) -> None:
+        if event.tags and event.tags.get('msg-id') == 'msg_channel_suspended':
+            if self.__to_join.cancel(event.channel):
+                self.__warning('Channel {} is suspended, connection aborted'.format(event.channel))
+                self.__drop_messages(event.channel)
+
     # notify a pong reception
     def __on_pong_handler(self) -> None:
         self.__notice('Pong received, connection is still alive')
@@ -324,30 +373,41 @@ class IRC:
     """
 
     def __open_socket(self) -> None:
-        self.__socket = socket.socket()
+        # drop the previous connection, if any
+        self.__transport.close()
         self.__set_status(0)
 
     def __connect_socket(self) -> bool:
         try:
-            self.__socket.connect((self.__host, self.__port))
-            self.__socket.setblocking(0)
-            self.__notice('Connected to {0[0]}:{0[1]}'.format(self.__socket.getpeername()))
+            self.__transport.connect(self.__host, self.__port)
+            self.__notice('Connected to {}'.format(self.__transport.peer_name()))
             self.__set_status(1)
             return True
 
         except socket.gaierror:
             self.__warning('Unable to connect.')
-            return False
+            raise
 
-    # fetch data from the socket
+    # fetch data from the transport
     def __receive_data(self):
-        # try to retrieve data from socket, timeout if nothing for .1 second
-        ready = select.select([self.__socket], [], [], 0.1)
-        if not ready[0]:
+        # try to retrieve data from the transport, timeout if nothing for .1 second
+        # don't wait at all if the next scheduled message can already be sent
+        if self.__to_send and self.__to_send[0][0] in self.__channels and \
+                self.__status == 3 and self.__socket_locked():
+            timeout = 0
+        else:
+            timeout = 0.1
+            # wake up in time for the next channel request retry, retries are only sent once ready
+            if self.__status == 3:
+                for scheduler in (self.__to_join, self.__to_part):
+                    deadline = scheduler.next_deadline()
+                    if deadline is not None:
+                        timeout = min(timeout, deadline)
+        if not self.__transport.wait(timeout):
             return
 
-        # get up to 1024 from the buffer and the socket then split the events
-        self.__buffer += self.__socket.recv(4096)
+        # get the available data from the transport then split the events
+        self.__buffer += self.__transport.recv()
         events = self.__buffer.split(b'\r\n')
         self.__buffer = events.pop()
 
@@ -361,41 +421,54 @@ class IRC:
     channels management
     """
 
-    # send a channel connection request
-    def __request_join(self, channel: str):
-        if self.__wait_for_status():
-            self.__send('JOIN #{}\r\n'.format(channel), ignore_throttle=1)
-
-    # send a channel disconnection request
-    def __request_part(self, channel: str):
-        if channel in self.channels and self.__wait_for_status():
-            self.__send('PART #{}\r\n'.format(channel), ignore_throttle=1)
+    # send the batched channel requests of a scheduler
+    def __request_channels(self, scheduler: ChannelScheduler, action: str):
+        packets, failed = scheduler.next_packets()
+        if packets and self.__wait_for_status():
+            for packet in packets:
+                self.__send(packet, ignore_throttle=1)
+        for channel in failed:
+            self.__warning('Failed to {} channel {}'.format(action, channel))
+            if scheduler is self.__to_join:
+                self.__drop_messages(channel)
 
     # rejoin all known channels
     def list_all_channels_to_reconnect(self):
-        channels_to_reconnect = []
-        for channel in self.__to_join:
-            channels_to_reconnect.append((channel[0], 0, time.time() - 5))
-        for channel in self.channels:
-            channels_to_reconnect.append((channel, 0, time.time() - 5))
-        self.__to_join = channels_to_reconnect
-        self.channels = {}
+        self.__request(self.__list_all_channels_to_reconnect)
+
+    def __list_all_channels_to_reconnect(self):
+        self.__to_join.reset()
+        for channel in self.__channels:
+            # channels waiting for a disconnection are not joined back
+            if channel not in self.__to_part:
+                self.__to_join.schedule(channel)
+        self.__to_part.clear()
+        self.__channels_dirty.update(self.__channels)
+        self.__channels = {}
 
     # request channel join
     def join(self, channel: str):
-        channels = list(self.channels)
+        self.__request(self.__join, channel)
 
-        if channel not in channels:
-            self.__to_join.append((channel, 0, time.time()-5))
+    def __join(self, channel: str):
+        if channel not in self.__channels:
+            self.__to_join.schedule(channel)
         else:
             self.__warning('Already connected to channel {}, connection aborted'.format(channel))
 
-    # request channel join
+    # request channel part
     def part(self, channel: str):
-        channels = list(self.channels)
-        scheduled_channels_connection = [item[0] for item in self.__to_join]
-        if channel in channels or channel in scheduled_channels_connection:
-            self.__to_part.append((channel, 0, time.time()-5))
+        self.__request(self.__part, channel)
+
+    def __part(self, channel: str):
+        if channel in self.__channels:
+            self.__to_part.schedule(channel)
+        elif channel in self.__to_join:
+            # the join request may already be on its way, part it once sent
+            if self.__to_join.tries(channel):
+                self.__to_part.schedule(channel)
+            self.__to_join.cancel(channel)
+            self.__drop_messages(channel)
         else:
             self.__warning('Not connected to channel {}, unable to disconnect'.format(channel))
 
@@ -423,7 +496,7 @@ class IRC:
         if self.__socket_locked() or ignore_throttle:
             # verify socket instance
             if self.__wait_for_status(0):
-                self.__socket.send(packet.encode('UTF-8'))
+                self.__transport.send(packet.encode('UTF-8'))
                 self.__event_sent_date.append(time.time())
             # creating '**..' string with the length required
             if obfuscate_after:
@@ -461,33 +534,37 @@ class IRC:
         # if there is message to send and socket ready and socket not throttling
         if len(self.__to_send) > 0 and self.__wait_for_status() and self.__socket_locked():
             # retrieve the first message to send
-            item = self.__to_send.pop(0)
+            item = self.__to_send.popleft()
             channel = item[0]
             message = item[1]
-            # if channel not connected, try to connect
-            if channel not in self.channels:
-                self.join(channel)
-                self.__warning('Try to send to not connected channel, connecting to the channel..')
-                # Listing all message for the same channel to preserve sending order
-                channel_messages = [item]
-                channel_indexes = []
-                for i in range(0, len(self.__to_send)):
-                    if channel == self.__to_send[i][0]:
-                        channel_messages.append(self.__to_send[i])
-                        channel_indexes.append(i)
-                # removing indexes
-                channel_indexes.reverse()
-                for indexes in channel_indexes:
-                    self.__to_send.pop(indexes)
-                # Adding all messages at the end of the list
-                self.__to_send = self.__to_send + channel_messages
+            # if channel not connected, try to connect and hold the message until connected
+            if channel not in self.__channels:
+                if channel not in self.__held_messages:
+                    self.__join(channel)
+                    self.__warning('Try to send to not connected channel, connecting to the channel..')
+                    self.__held_messages[channel] = []
+                self.__held_messages[channel].append(item)
 
             else:
                 packet = "PRIVMSG #{} :{}\r\n".format(channel, message)
                 self.__send(packet)
 
+    # schedule back the messages held for a newly connected channel
+    def __release_messages(self, channel: str) -> None:
+        # held messages were scheduled before any message of the channel still in the queue
+        self.__to_send.extendleft(reversed(self.__held_messages.pop(channel, [])))
+
+    # forget the messages held for a channel which won't be connected
+    def __drop_messages(self, channel: str) -> None:
+        messages = self.__held_messages.pop(channel, [])
+        if messages:
+            self.__warning('{} messages to channel {} dropped'.format(len(messages), channel))
+
     # request the sending of a message
     def send(self, channel: str, message: str):
+        self.__request(self.__schedule_message, channel, message)
+
+    def __schedule_message(self, channel: str, message: str):
         self.__to_send.append((channel, message))
 
     # send a IRC capability request
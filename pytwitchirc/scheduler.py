@@ -0,0 +1,159 @@
+import collections
+import heapq
+import time
+
+
+class ChannelScheduler:
+
+    def __init__(self, command: str, max_try=5, timeout=5, throttle=None, period=10, line_length=512):
+        """
+
+        :param command: IRC command sent for the scheduled channels (JOIN or PART)
+        :param max_try: maximum try before abort the command for a channel
+        :param timeout: seconds to wait for a confirmation before trying again
+        :param throttle: maximum number of channels sent per period, unlimited if None
+        :param period: length in seconds of the throttle window
+        :param line_length: maximum length of a packet, including the trailing CRLF
+        """
+        self.__command = command
+        self.__max_try = max_try
+        self.__timeout = timeout
+        self.__throttle = throttle
+        self.__period = period
+        self.__line_length = line_length
+
+        # channel -> number of tries already sent
+        self.__pending = {}
+        # channels waiting to be sent, in scheduling order
+        self.__ready = collections.deque()
+        self.__queued = set()
+        # (deadline, sequence, channel) waiting for a confirmation
+        self.__timeouts = []
+        # channel -> sequence of its last try, older heap entries are stale
+        self.__waiting = {}
+        self.__sequence = 0
+        # sending date of every channel in the throttle window
+        self.__sent_date = collections.deque()
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.__pending
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+    def __iter__(self):
+        return iter(list(self.__pending))
+
+    # schedule a channel, ignored if the channel is already scheduled
+    def schedule(self, channel: str) -> None:
+        if channel not in self.__pending:
+            self.__pending[channel] = 0
+            self.__enqueue(channel)
+
+    # the server confirmed the command for this channel, stop tracking it
+    def confirm(self, channel: str) -> bool:
+        self.__waiting.pop(channel, None)
+        return self.__pending.pop(channel, None) is not None
+
+    # stop tracking a channel without confirmation
+    def cancel(self, channel: str) -> bool:
+        return self.confirm(channel)
+
+    # number of tries already sent for a scheduled channel
+    def tries(self, channel: str) -> int:
+        return self.__pending.get(channel, 0)
+
+    # forget every scheduled channel
+    def clear(self) -> None:
+        self.__pending.clear()
+        self.__ready.clear()
+        self.__queued.clear()
+        self.__timeouts = []
+        self.__waiting.clear()
+
+    # schedule back every tracked channel from scratch, used after a reconnection
+    def reset(self) -> None:
+        channels = list(self.__pending)
+        self.clear()
+        for channel in channels:
+            self.schedule(channel)
+
+    # retrieve the packets ready to be sent and the channels which ran out of tries
+    def next_packets(self) -> tuple:
+        now = time.time()
+        failed = self.__expire(now)
+
+        packets = []
+        channels = []
+        length = 0
+        budget = self.__budget(now)
+        while self.__ready and budget > 0:
+            channel = self.__ready.popleft()
+            self.__queued.discard(channel)
+            # skip channels confirmed or canceled while waiting
+            if channel not in self.__pending:
+                continue
+            # ',#channel' or ' #channel', flush the packet if the line is full
+            size = len(channel) + 2
+            if channels and length + size > self.__line_length:
+                packets.append(self.__packet(channels))
+                channels = []
+            if not channels:
+                # 'COMMAND' and the trailing '\r\n'
+                length = len(self.__command) + 2
+            channels.append(channel)
+            length += size
+            budget -= 1
+
+            # track the try and wait for the confirmation
+            tries = self.__pending[channel] + 1
+            self.__pending[channel] = tries
+            self.__sequence += 1
+            self.__waiting[channel] = self.__sequence
+            heapq.heappush(self.__timeouts, (now + self.__timeout, self.__sequence, channel))
+            if self.__throttle is not None:
+                self.__sent_date.append(now)
+
+        if channels:
+            packets.append(self.__packet(channels))
+        return packets, failed
+
+    # seconds until the next scheduled retry, None if nothing is waiting for a confirmation
+    def next_deadline(self):
+        while self.__timeouts and self.__waiting.get(self.__timeouts[0][2]) != self.__timeouts[0][1]:
+            heapq.heappop(self.__timeouts)
+        if not self.__timeouts:
+            return None
+        return max(0, self.__timeouts[0][0] - time.time())
+
+    def __enqueue(self, channel: str) -> None:
+        if channel not in self.__queued:
+            self.__queued.add(channel)
+            self.__ready.append(channel)
+
+    def __packet(self, channels: list) -> str:
+        return '{} {}\r\n'.format(self.__command, ','.join('#' + channel for channel in channels))
+
+    # move the unconfirmed channels back in the ready queue, return the ones out of tries
+    def __expire(self, now: float) -> list:
+        failed = []
+        while self.__timeouts and self.__timeouts[0][0] <= now:
+            deadline, sequence, channel = heapq.heappop(self.__timeouts)
+            # stale entry, the channel got confirmed or sent again since
+            if self.__waiting.get(channel) != sequence:
+                continue
+            del self.__waiting[channel]
+            if self.__pending[channel] < self.__max_try:
+                self.__enqueue(channel)
+            else:
+                self.__pending.pop(channel)
+                failed.append(channel)
+        return failed
+
+    # number of channels which can be sent without exceeding the throttle
+    def __budget(self, now: float) -> int:
+        if self.__throttle is None:
+            return len(self.__ready)
+        while self.__sent_date and now - self.__sent_date[0] > self.__period:
+            self.__sent_date.popleft()
+        return self.__throttle - len(self.__sent_date)
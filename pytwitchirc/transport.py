@@ -0,0 +1,418 @@
+import abc
+import base64
+import collections
+import hashlib
+import os
+import select
+import socket
+import ssl
+import struct
+import threading
+
+
+class Transport(abc.ABC):
+    """
+    Byte stream between the client and the IRC server.
+    A transport can be connected again after being closed, the client reuse it on every reconnection.
+    """
+
+    @abc.abstractmethod
+    def connect(self, host: str, port: int) -> None:
+        pass
+
+    # wait until data can be received, return false if nothing arrived before the timeout
+    @abc.abstractmethod
+    def wait(self, timeout: float) -> bool:
+        pass
+
+    # interrupt a pending wait from another thread
+    def wakeup(self) -> None:
+        pass
+
+    # receive the available data, raise ConnectionResetError if the server closed the connection
+    @abc.abstractmethod
+    def recv(self) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def send(self, data: bytes) -> None:
+        pass
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        pass
+
+    # address of the server, used for logging
+    @abc.abstractmethod
+    def peer_name(self) -> str:
+        pass
+
+    # release every resource held by the transport, it can't be connected anymore
+    def dispose(self) -> None:
+        self.close()
+
+
+class TCPTransport(Transport):
+
+    def __init__(self, timeout=10, buffer_size=4096):
+        """
+
+        :param timeout: seconds before a blocking socket operation raise socket.timeout
+        :param buffer_size: maximum number of bytes read at once
+        """
+        self._timeout = timeout
+        self._buffer_size = buffer_size
+        self._socket = None
+        # self-pipe, written by wakeup to interrupt select, open until dispose is called
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        # wakeup may be called by any thread while the transport is disposed
+        self._wakeup_lock = threading.Lock()
+
+    def connect(self, host: str, port: int) -> None:
+        self.close()
+        self._socket = self._open(host, port)
+        self._socket.settimeout(self._timeout)
+
+    def _open(self, host: str, port: int) -> socket.socket:
+        return socket.create_connection((host, port), timeout=self._timeout)
+
+    def wait(self, timeout: float) -> bool:
+        ready = select.select([self._socket, self._wakeup_read], [], [], timeout)[0]
+        if self._wakeup_read in ready:
+            self._drain_wakeup()
+        return self._socket in ready
+
+    def wakeup(self) -> None:
+        with self._wakeup_lock:
+            if self._wakeup_write is None:
+                return
+            try:
+                os.write(self._wakeup_write, b'\0')
+            except BlockingIOError:
+                # the pipe is full, a wakeup is already pending
+                pass
+
+    def _drain_wakeup(self) -> None:
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def recv(self) -> bytes:
+        data = self._socket.recv(self._buffer_size)
+        if not data:
+            raise ConnectionResetError('Connection closed by the server')
+        return data
+
+    def send(self, data: bytes) -> None:
+        self._socket.sendall(data)
+
+    def close(self) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+    def peer_name(self) -> str:
+        return '{0[0]}:{0[1]}'.format(self._socket.getpeername())
+
+    # release the socket and the wakeup pipe, the transport can't be used anymore
+    def dispose(self) -> None:
+        self.close()
+        with self._wakeup_lock:
+            for fd in (self._wakeup_read, self._wakeup_write):
+                if fd is not None:
+                    os.close(fd)
+            self._wakeup_read = self._wakeup_write = None
+
+
+class TLSTransport(TCPTransport):
+
+    def __init__(self, timeout=10, buffer_size=4096, context=None):
+        """
+
+        :param timeout: seconds before a blocking socket operation raise socket.timeout
+        :param buffer_size: maximum number of bytes read at once
+        :param context: ssl.SSLContext used to wrap the socket, system defaults if None
+        """
+        TCPTransport.__init__(self, timeout, buffer_size)
+        self._context = context or ssl.create_default_context()
+
+    def _open(self, host: str, port: int) -> socket.socket:
+        raw = TCPTransport._open(self, host, port)
+        try:
+            return self._context.wrap_socket(raw, server_hostname=host)
+        except (OSError, ssl.SSLError):
+            raw.close()
+            raise
+
+    def wait(self, timeout: float) -> bool:
+        # decrypted data may already be buffered by the ssl layer
+        if self._socket.pending():
+            return True
+        return TCPTransport.wait(self, timeout)
+
+
+class WebSocketTransport(TLSTransport):
+    """
+    Twitch WebSocket endpoint (wss://irc-ws.chat.twitch.tv:443), IRC lines are carried by text frames.
+    """
+
+    GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, timeout=10, buffer_size=4096, context=None, secure=True, path='/'):
+        """
+
+        :param timeout: seconds before a blocking socket operation raise socket.timeout
+        :param buffer_size: maximum number of bytes read at once
+        :param context: ssl.SSLContext used to wrap the socket, system defaults if None
+        :param secure: use wss:// if true, plain ws:// otherwise
+        :param path: resource requested during the handshake
+        """
+        TLSTransport.__init__(self, timeout, buffer_size, context)
+        self._secure = secure
+        self._path = path
+        self._frames = b''
+        self._fragments = b''
+        self._buffered = False
+        # a close frame was received, raise once the data before it is read
+        self._closed = False
+
+    def _open(self, host: str, port: int) -> socket.socket:
+        if self._secure:
+            return TLSTransport._open(self, host, port)
+        return TCPTransport._open(self, host, port)
+
+    def connect(self, host: str, port: int) -> None:
+        TLSTransport.connect(self, host, port)
+        self._frames = b''
+        self._fragments = b''
+        self._closed = False
+        self._handshake(host, port)
+        # frames received along with the handshake response
+        self._buffered = bool(self._frames)
+
+    def wait(self, timeout: float) -> bool:
+        if self._buffered or self._closed:
+            return True
+        if self._secure:
+            return TLSTransport.wait(self, timeout)
+        return TCPTransport.wait(self, timeout)
+
+    def recv(self) -> bytes:
+        if self._closed:
+            raise ConnectionResetError('WebSocket closed by the server')
+        if self._buffered:
+            self._buffered = False
+        else:
+            self._frames += TLSTransport.recv(self)
+        data = []
+        # decode every complete frame, keep the partial one for the next call
+        while True:
+            frame = self._read_frame()
+            if frame is None:
+                break
+            opcode, payload = frame
+            if opcode == 0x8:
+                # answer with the status code received and stop reading
+                self._closed = True
+                try:
+                    self._send_frame(0x8, payload[:2])
+                except OSError:
+                    pass
+                break
+            elif opcode == 0x9:
+                self._send_frame(0xA, payload)
+            elif opcode in (0x0, 0x1, 0x2):
+                data.append(payload)
+        if self._closed and not data:
+            raise ConnectionResetError('WebSocket closed by the server')
+        return b''.join(data)
+
+    def send(self, data: bytes) -> None:
+        self._send_frame(0x1, data)
+
+    def _handshake(self, host: str, port: int) -> None:
+        key = base64.b64encode(os.urandom(16))
+        request = ('GET {} HTTP/1.1\r\n'
+                   'Host: {}:{}\r\n'
+                   'Upgrade: websocket\r\n'
+                   'Connection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: {}\r\n'
+                   'Sec-WebSocket-Version: 13\r\n'
+                   'Sec-WebSocket-Protocol: irc\r\n\r\n').format(self._path, host, port, key.decode('ascii'))
+        self._socket.sendall(request.encode('ascii'))
+
+        # read the response headers, data following them are already frames
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = self._socket.recv(self._buffer_size)
+            if not chunk:
+                raise ConnectionResetError('Connection closed during the WebSocket handshake')
+            response += chunk
+        headers, self._frames = response.split(b'\r\n\r\n', 1)
+        lines = headers.decode('latin-1').split('\r\n')
+
+        if len(lines[0].split()) < 2 or lines[0].split()[1] != '101':
+            raise ConnectionResetError('WebSocket handshake refused : {}'.format(lines[0]))
+        accept = base64.b64encode(hashlib.sha1(key + self.GUID).digest()).decode('ascii')
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'sec-websocket-accept' and value.strip() == accept:
+                return
+        raise ConnectionResetError('WebSocket handshake failed, invalid Sec-WebSocket-Accept')
+
+    # pop a complete frame from the buffer, return (opcode, payload) or None
+    def _read_frame(self):
+        while True:
+            if len(self._frames) < 2:
+                return None
+            first, second = self._frames[0], self._frames[1]
+            offset = 2
+            length = second & 0x7F
+            if length == 126:
+                if len(self._frames) < 4:
+                    return None
+                length = struct.unpack('!H', self._frames[2:4])[0]
+                offset = 4
+            elif length == 127:
+                if len(self._frames) < 10:
+                    return None
+                length = struct.unpack('!Q', self._frames[2:10])[0]
+                offset = 10
+            mask = None
+            if second & 0x80:
+                mask = self._frames[offset:offset + 4]
+                offset += 4
+            if len(self._frames) < offset + length:
+                return None
+
+            payload = self._frames[offset:offset + length]
+            self._frames = self._frames[offset + length:]
+            if mask:
+                payload = self._unmask(payload, mask)
+
+            opcode = first & 0x0F
+            # control frames are never fragmented
+            if opcode >= 0x8:
+                return opcode, payload
+            self._fragments += payload
+            if first & 0x80:
+                payload, self._fragments = self._fragments, b''
+                return 0x1, payload
+
+    def _send_frame(self, opcode: int, payload: bytes) -> None:
+        # client frames must be masked
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', length)
+        mask = os.urandom(4)
+        self._socket.sendall(header + mask + self._unmask(payload, mask))
+
+    @staticmethod
+    def _unmask(payload: bytes, mask: bytes) -> bytes:
+        # xor the payload with the repeated 4 bytes mask
+        length = len(payload)
+        key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+        return (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+
+
+class MemoryTransport(Transport):
+    """
+    In-memory pipe, the server side is played through `peer`. No socket is involved.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__incoming = collections.deque()
+        self.__outgoing = collections.deque()
+        self.__closed = False
+        self.__woken = False
+        self.__host = None
+        self.peer = MemoryPeer(self)
+
+    # data pushed by the peer before the connection is kept, the client reads it once connected
+    def connect(self, host: str, port: int) -> None:
+        with self.__condition:
+            self.__closed = False
+            self.__host = '{}:{}'.format(host, port)
+            self.__condition.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__incoming or self.__closed or self.__woken, timeout)
+            self.__woken = False
+            return bool(self.__incoming or self.__closed)
+
+    def wakeup(self) -> None:
+        with self.__condition:
+            self.__woken = True
+            self.__condition.notify_all()
+
+    def recv(self) -> bytes:
+        with self.__condition:
+            if not self.__incoming and self.__closed:
+                raise ConnectionResetError('Connection closed by the peer')
+            data = b''.join(self.__incoming)
+            self.__incoming.clear()
+            return data
+
+    def send(self, data: bytes) -> None:
+        with self.__condition:
+            if self.__closed:
+                raise BrokenPipeError('Connection closed by the peer')
+            self.__outgoing.append(data)
+            self.__condition.notify_all()
+
+    def close(self) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def peer_name(self) -> str:
+        return self.__host
+
+    # peer side
+
+    def _peer_send(self, data: bytes) -> None:
+        with self.__condition:
+            self.__incoming.append(data)
+            self.__condition.notify_all()
+
+    def _peer_recv(self, timeout=None) -> bytes:
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__outgoing or self.__closed, timeout)
+            data = b''.join(self.__outgoing)
+            self.__outgoing.clear()
+            return data
+
+
+class MemoryPeer:
+    """
+    Server end of a MemoryTransport.
+    """
+
+    def __init__(self, transport: MemoryTransport):
+        self.__transport = transport
+
+    # push data to the client
+    def send(self, data: bytes) -> None:
+        self.__transport._peer_send(data)
+
+    # retrieve the data sent by the client, wait up to timeout seconds if nothing was sent yet
+    def recv(self, timeout=None) -> bytes:
+        return self.__transport._peer_recv(timeout)
+
+    # close the connection, the client raise ConnectionResetError once the pending data is read
+    def close(self) -> None:
+        self.__transport.close()
@@ -0,0 +1,164 @@
+import re
+import threading
+import time
+import types
+
+from pytwitchirc.irc import IRC
+from pytwitchirc.transport import MemoryTransport
+
+PRODUCERS = 16
+MESSAGES = 3000
+
+
+class ScriptedServer:
+    """
+    Plays the Twitch server on the peer side of a MemoryTransport.
+    Capabilities are acknowledged, JOIN and PART requests are echoed unless the channel is ignored.
+    """
+
+    def __init__(self, transport: MemoryTransport, nickname='bot', ignored=()):
+        self.peer = transport.peer
+        self.nickname = nickname
+        self.ignored = set(ignored)
+        self.lines = []
+        self.__buffer = b''
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        self.__thread.join()
+
+    def messages(self) -> list:
+        return [line for line in list(self.lines) if line.startswith('PRIVMSG')]
+
+    def wait_for(self, predicate, timeout=30) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def __run(self):
+        while self.__running:
+            self.__buffer += self.peer.recv(0.1)
+            lines = self.__buffer.split(b'\r\n')
+            self.__buffer = lines.pop()
+            for line in lines:
+                self.__answer(line.decode('utf-8'))
+
+    def __answer(self, line: str):
+        self.lines.append(line)
+        command, _, argument = line.partition(' ')
+        if command == 'CAP':
+            self.peer.send(':tmi.twitch.tv CAP * ACK {}\r\n'.format(argument.split(' ', 1)[1]).encode('utf-8'))
+        elif command in ('JOIN', 'PART'):
+            for channel in argument.split(','):
+                if channel[1:] not in self.ignored:
+                    self.peer.send(':{0}!{0}@{0}.tmi.twitch.tv {1} {2}\r\n'.format(
+                        self.nickname, command, channel).encode('utf-8'))
+
+
+def connect(**kwargs):
+    transport = MemoryTransport()
+    server = ScriptedServer(transport, **kwargs)
+    client = IRC('bot', 'oauth:test', throttle=10 ** 9, transport=transport)
+    return client, server
+
+
+def test_many_producers():
+    client, server = connect()
+    client.join('shared')
+    assert server.wait_for(lambda: 'shared' in client.channels)
+
+    snapshots_valid = []
+    producing = threading.Event()
+
+    def produce(index):
+        client.join('extra{}'.format(index))
+        for i in range(MESSAGES):
+            client.send('shared', '{}-{}'.format(index, i))
+        client.part('extra{}'.format(index))
+
+    def read_snapshots():
+        valid = True
+        while producing.is_set():
+            channels = client.channels
+            valid = valid and isinstance(channels, types.MappingProxyType) and \
+                all(isinstance(chatters, tuple) for chatters in channels.values())
+        snapshots_valid.append(valid)
+
+    producing.set()
+    reader = threading.Thread(target=read_snapshots)
+    reader.start()
+    producers = [threading.Thread(target=produce, args=(i,)) for i in range(PRODUCERS)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+
+    assert server.wait_for(lambda: len(server.messages()) >= PRODUCERS * MESSAGES)
+    producing.clear()
+    reader.join()
+    server.stop()
+
+    messages = server.messages()
+    assert len(messages) == PRODUCERS * MESSAGES
+    received = {index: [] for index in range(PRODUCERS)}
+    for message in messages:
+        index, i = re.match(r'PRIVMSG #shared :(\d+)-(\d+)', message).groups()
+        received[int(index)].append(int(i))
+    for index in range(PRODUCERS):
+        assert received[index] == list(range(MESSAGES))
+    assert snapshots_valid == [True]
+
+
+def test_messages_held_until_joined():
+    client, server = connect(ignored={'late'})
+    client.send('late', 'first')
+    client.send('late', 'second')
+    assert server.wait_for(lambda: any(line.startswith('JOIN #late') for line in server.lines))
+
+    # nothing is sent while the channel is not joined
+    time.sleep(0.3)
+    assert server.messages() == []
+
+    server.peer.send(b':bot!bot@bot.tmi.twitch.tv JOIN #late\r\n')
+    assert server.wait_for(lambda: len(server.messages()) == 2)
+    server.stop()
+    assert server.messages() == ['PRIVMSG #late :first', 'PRIVMSG #late :second']
+    assert client.channels == {'late': ()}
+
+
+def test_messages_dropped_for_suspended_channel():
+    client, server = connect(ignored={'gone'})
+    client.send('gone', 'a')
+    assert server.wait_for(lambda: any(line.startswith('JOIN #gone') for line in server.lines))
+    client.send('gone', 'b')
+    time.sleep(0.3)
+
+    server.peer.send(b'@msg-id=msg_channel_suspended :tmi.twitch.tv NOTICE #gone :This channel has been suspended.\r\n')
+    time.sleep(0.3)
+    assert client._IRC__held_messages == {}
+
+    # later messages trigger a new connection attempt
+    joins = len([line for line in server.lines if line.startswith('JOIN #gone')])
+    client.send('gone', 'c')
+    assert server.wait_for(lambda: len([line for line in server.lines if line.startswith('JOIN #gone')]) > joins)
+    server.stop()
+    assert server.messages() == []
+
+
+def test_close():
+    client, server = connect()
+    client.join('shared')
+    assert server.wait_for(lambda: 'shared' in client.channels)
+
+    client.close()
+    assert not client._IRC__thread.is_alive()
+    # requests after close are ignored
+    client.send('shared', 'late')
+    server.stop()
+    assert server.messages() == []
@@ -0,0 +1,113 @@
+import time
+
+from pytwitchirc.scheduler import ChannelScheduler
+
+
+def channels(packet: str) -> list:
+    return [channel[1:] for channel in packet[5:-2].split(',')]
+
+
+def test_packets_fit_line_length():
+    scheduler = ChannelScheduler('JOIN')
+    names = ['channel{:03d}'.format(i) for i in range(150)]
+    for name in names:
+        scheduler.schedule(name)
+
+    packets, failed = scheduler.next_packets()
+    # 'JOIN' + CRLF then 12 bytes per channel, a 43rd channel would exceed 512 bytes
+    assert [len(packet) for packet in packets] == [510, 510, 510, 294]
+    assert all(packet.startswith('JOIN #') and packet.endswith('\r\n') for packet in packets)
+    assert sum((channels(packet) for packet in packets), []) == names
+    assert failed == []
+
+
+def test_schedule_is_idempotent():
+    scheduler = ChannelScheduler('PART')
+    scheduler.schedule('a')
+    scheduler.schedule('a')
+    assert len(scheduler) == 1
+    assert scheduler.next_packets() == (['PART #a\r\n'], [])
+
+
+def test_throttle_budget():
+    scheduler = ChannelScheduler('JOIN', throttle=3, period=0.2)
+    for name in 'abcde':
+        scheduler.schedule(name)
+
+    packets, _ = scheduler.next_packets()
+    assert packets == ['JOIN #a,#b,#c\r\n']
+    assert scheduler.next_packets() == ([], [])
+
+    time.sleep(0.25)
+    packets, _ = scheduler.next_packets()
+    assert packets == ['JOIN #d,#e\r\n']
+
+
+def test_retry_after_timeout():
+    scheduler = ChannelScheduler('JOIN', timeout=0.2)
+    scheduler.schedule('a')
+    scheduler.schedule('b')
+    assert scheduler.next_packets() == (['JOIN #a,#b\r\n'], [])
+    assert 0 < scheduler.next_deadline() <= 0.2
+
+    # nothing is sent again before the timeout
+    scheduler.confirm('a')
+    assert scheduler.next_packets() == ([], [])
+
+    time.sleep(0.25)
+    assert scheduler.next_deadline() == 0
+    assert scheduler.next_packets() == (['JOIN #b\r\n'], [])
+    assert scheduler.tries('b') == 2
+
+
+def test_max_try():
+    scheduler = ChannelScheduler('JOIN', max_try=2, timeout=0.05)
+    scheduler.schedule('a')
+    assert scheduler.next_packets() == (['JOIN #a\r\n'], [])
+    time.sleep(0.1)
+    assert scheduler.next_packets() == (['JOIN #a\r\n'], [])
+    time.sleep(0.1)
+    assert scheduler.next_packets() == ([], ['a'])
+    assert 'a' not in scheduler
+    assert scheduler.next_deadline() is None
+
+
+def test_stale_timeout_after_cancel():
+    scheduler = ChannelScheduler('JOIN', timeout=0.1)
+    scheduler.schedule('a')
+    scheduler.next_packets()
+    assert scheduler.cancel('a')
+    assert not scheduler.cancel('a')
+
+    # scheduled again, the first try timeout must not trigger an early retry
+    time.sleep(0.06)
+    scheduler.schedule('a')
+    assert scheduler.next_packets() == (['JOIN #a\r\n'], [])
+    time.sleep(0.06)
+    assert scheduler.next_packets() == ([], [])
+    assert scheduler.tries('a') == 1
+
+
+def test_canceled_before_sending():
+    scheduler = ChannelScheduler('JOIN')
+    scheduler.schedule('a')
+    scheduler.schedule('b')
+    scheduler.cancel('a')
+    assert scheduler.next_packets() == (['JOIN #b\r\n'], [])
+
+
+def test_reset():
+    scheduler = ChannelScheduler('JOIN', timeout=60)
+    scheduler.schedule('a')
+    scheduler.schedule('b')
+    scheduler.next_packets()
+    assert scheduler.tries('a') == 1
+
+    scheduler.reset()
+    assert scheduler.tries('a') == 0
+    assert scheduler.next_deadline() is None
+    assert scheduler.next_packets() == (['JOIN #a,#b\r\n'], [])
+
+    scheduler.clear()
+    assert len(scheduler) == 0
+    assert scheduler.next_packets() == ([], [])
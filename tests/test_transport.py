@@ -0,0 +1,231 @@
+import base64
+import hashlib
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from pytwitchirc.transport import MemoryTransport, TCPTransport, Transport, WebSocketTransport
+
+
+def frame(opcode: int, payload: bytes, fin=True) -> bytes:
+    # server frames are not masked
+    header = bytes([(0x80 if fin else 0) | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack('!H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('!Q', len(payload))
+    return header + payload
+
+
+def read_frame(connection: socket.socket) -> tuple:
+    def read(size):
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            assert chunk
+            data += chunk
+        return data
+
+    first, second = read(2)
+    # client frames must be masked
+    assert second & 0x80
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', read(8))[0]
+    mask = read(4)
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(read(length)))
+    return first & 0x0F, payload
+
+
+class WebSocketServer:
+    """
+    Loopback server accepting a single WebSocket connection, `script` plays the server side.
+    """
+
+    def __init__(self, script, accept=True):
+        self.__listener = socket.socket()
+        self.__listener.bind(('127.0.0.1', 0))
+        self.__listener.listen(1)
+        self.port = self.__listener.getsockname()[1]
+        self.__script = script
+        self.__accept = accept
+        self.error = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def join(self):
+        self.__thread.join(5)
+        self.__listener.close()
+        if self.error:
+            raise self.error
+
+    def __run(self):
+        connection, _ = self.__listener.accept()
+        connection.settimeout(5)
+        try:
+            request = b''
+            while b'\r\n\r\n' not in request:
+                request += connection.recv(4096)
+            key = [line.split(b':', 1)[1].strip() for line in request.split(b'\r\n')
+                   if line.lower().startswith(b'sec-websocket-key:')][0]
+            accept = base64.b64encode(hashlib.sha1(key + WebSocketTransport.GUID).digest())
+            if not self.__accept:
+                accept = b'invalid'
+            response = b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n' \
+                       b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+            self.__script(connection, response)
+        except Exception as e:
+            self.error = e
+        finally:
+            connection.close()
+
+
+def receive(transport: WebSocketTransport, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        assert transport.wait(5)
+        data += transport.recv()
+    return data
+
+
+def test_websocket_frames():
+    big = b'x' * 70000 + b'\r\n'
+    medium = b'y' * 300 + b'\r\n'
+    received = {}
+
+    def script(connection, response):
+        # the first frame comes along with the handshake response
+        connection.sendall(response + frame(0x1, b'PING :tmi.twitch.tv\r\n'))
+        # fragmented message, split across several writes
+        fragments = frame(0x1, b'PRIVMSG #a :hel', fin=False) + frame(0x0, b'lo\r\n')
+        connection.sendall(fragments[:5])
+        connection.sendall(fragments[5:])
+        connection.sendall(frame(0x1, medium) + frame(0x1, big))
+        connection.sendall(frame(0x9, b'beat'))
+        received['pong'] = read_frame(connection)
+        received['text'] = read_frame(connection)
+
+    server = WebSocketServer(script)
+    transport = WebSocketTransport(secure=False)
+    transport.connect('127.0.0.1', server.port)
+
+    expected = b'PING :tmi.twitch.tv\r\nPRIVMSG #a :hello\r\n' + medium + big
+    assert receive(transport, len(expected)) == expected
+    # the ping is answered while reading
+    while 'pong' not in received:
+        if transport.wait(0.1):
+            transport.recv()
+    transport.send(b'PONG :tmi.twitch.tv\r\n')
+    server.join()
+
+    assert received['pong'] == (0xA, b'beat')
+    assert received['text'] == (0x1, b'PONG :tmi.twitch.tv\r\n')
+    transport.close()
+
+
+def test_websocket_close_keeps_previous_data():
+    received = {}
+
+    def script(connection, response):
+        connection.sendall(response)
+        connection.sendall(frame(0x1, b':tmi.twitch.tv RECONNECT\r\n') + frame(0x8, struct.pack('!H', 1000)))
+        received['close'] = read_frame(connection)
+
+    server = WebSocketServer(script)
+    transport = WebSocketTransport(secure=False)
+    transport.connect('127.0.0.1', server.port)
+
+    assert receive(transport, 1) == b':tmi.twitch.tv RECONNECT\r\n'
+    assert transport.wait(0)
+    with pytest.raises(ConnectionResetError):
+        transport.recv()
+    server.join()
+
+    # the close frame is answered with the same status code
+    assert received['close'] == (0x8, struct.pack('!H', 1000))
+    transport.close()
+
+
+def test_websocket_invalid_handshake():
+    server = WebSocketServer(lambda connection, response: connection.sendall(response), accept=False)
+    transport = WebSocketTransport(secure=False)
+    with pytest.raises(ConnectionResetError):
+        transport.connect('127.0.0.1', server.port)
+    server.join()
+    transport.close()
+
+
+def test_incomplete_transport():
+    class Incomplete(Transport):
+        def connect(self, host, port):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_memory_transport_keeps_data_across_connect():
+    transport = MemoryTransport()
+    # pushed before the client connects
+    transport.peer.send(b'PING :tmi.twitch.tv\r\n')
+    transport.connect('memory', 0)
+    assert transport.peer_name() == 'memory:0'
+    assert transport.wait(0)
+    assert transport.recv() == b'PING :tmi.twitch.tv\r\n'
+
+    # unread client output survives a reconnection
+    transport.send(b'PONG :tmi.twitch.tv\r\n')
+    transport.close()
+    transport.connect('memory', 0)
+    assert transport.peer.recv(0) == b'PONG :tmi.twitch.tv\r\n'
+    assert not transport.wait(0)
+
+
+def test_memory_transport_peer_close():
+    transport = MemoryTransport()
+    transport.connect('memory', 0)
+    transport.peer.send(b'last\r\n')
+    transport.peer.close()
+
+    # pending data is read before the connection is reported closed
+    assert transport.wait(0)
+    assert transport.recv() == b'last\r\n'
+    with pytest.raises(ConnectionResetError):
+        transport.recv()
+    with pytest.raises(BrokenPipeError):
+        transport.send(b'PING\r\n')
+
+
+def test_tcp_wakeup_and_dispose():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    transport = TCPTransport()
+    transport.connect('127.0.0.1', listener.getsockname()[1])
+    connection, _ = listener.accept()
+
+    # a wakeup from another thread interrupts the wait without reporting data
+    timer = threading.Timer(0.1, transport.wakeup)
+    timer.start()
+    start = time.time()
+    assert not transport.wait(5)
+    assert time.time() - start < 1
+    timer.join()
+
+    pipe = (transport._wakeup_read, transport._wakeup_write)
+    transport.dispose()
+    for fd in pipe:
+        with pytest.raises(OSError):
+            os.fstat(fd)
+    # nothing to wake up anymore
+    transport.wakeup()
+    connection.close()
+    listener.close()